@@ -1,10 +1,7 @@
 #-------------------------------------------------Libraries
 import os
 from datetime import datetime as dt
-from Functions.load_spec import load_spec
-from Functions.load_data import load_data
-from Functions.dfm import dfm
-import pickle
+from Functions.estimate_vintages import estimate_vintages
 import pandas as pd
 
 
@@ -26,39 +23,20 @@ vintages     = ['2017-01-03', '2017-04-03', '2017-07-03', '2017-10-02',
 # vintage dataset to use for estimation
 country      = 'US_fiscal'                                                           # United States macroeconomic data
 sample_start = dt.strptime("2000-01-01", '%Y-%m-%d').date().toordinal() + 366 # estimation sample
+warm_start   = False                                                          # True: start each vintage from the previous one's estimates (runs serially)
+n_workers    = None                                                           # parallel estimations (None: one per core)
+blas_threads = 1                                                              # BLAS threads per parallel estimation
+output_dir   = 'DFM_quarter_param_fiscal'
 
 
-#-------------------------------------------------Load model specification and dataset.
-# Load model specification structure `Spec`
-Spec = load_spec('Spec_US_fiscal.xlsx')
-
-# Parse `Spec`
-SeriesID         = Spec.SeriesID
-SeriesName       = Spec.SeriesName
-Units            = Spec.Units
-UnitsTransformed = Spec.UnitsTransformed
-
-# Load data
-for vintage in vintages:
-    datafile   = os.path.join('data',country,vintage + '.xlsx')
-    X,Time,Z   = load_data(datafile,Spec,sample_start)
-
-
-    # sanity check
-    assert X.shape[1] == len(Spec.SeriesName), "X e Spec non allineati"
-
-
-    #-------------------------------------------------Run dynamic factor model (DFM) and save estimation output as 'ResDFM'.
+#-------------------------------------------------Run dynamic factor model (DFM) and save estimation output as 'ResDFM'.
+if __name__ == "__main__":
     threshold = 1e-4 # Set to 1e-5 for more robust estimates
-    Res = dfm(X,Spec,threshold)
-    Res = {"Res": Res,"Spec":Spec}
-
-    #-------------------------------------------------Save output in dedicated folder
-    output_dir = 'DFM_quarter_param_fiscal'
-    os.makedirs(output_dir, exist_ok=True)
-    file_name = 'ResDFM' + '_fiscal_' + vintage.replace('-', '') + '.pickle'
-    output_path = os.path.join(output_dir, file_name)
-
-    with open(file_name, 'wb') as handle:
-        pickle.dump(Res, handle)
-    # TODO: Res and Spec should be separate, this will be fixed after the unit tests are created
+    report    = estimate_vintages(vintages,'Spec_US_fiscal.xlsx',os.path.join('data',country),output_dir,
+                                  prefix       = 'ResDFM_fiscal_',
+                                  sample_start = sample_start,
+                                  threshold    = threshold,
+                                  n_workers    = 1 if warm_start else n_workers,
+                                  blas_threads = blas_threads,
+                                  warm_start   = warm_start)
+    print(report)
@@ -0,0 +1,238 @@
+#-------------------------------------------------Libraries
+import os
+import time
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from Functions.load_spec import load_spec
+from Functions.load_data import load_data
+from Functions.dfm import dfm, SaveAtomic
+
+
+#-------------------------------------------------Environment variables of the BLAS/OpenMP thread pools
+BLAS_THREAD_VARS = ["OMP_NUM_THREADS","OPENBLAS_NUM_THREADS","MKL_NUM_THREADS",
+                    "VECLIB_MAXIMUM_THREADS","NUMEXPR_NUM_THREADS"]
+
+
+#-------------------------------------------------Parallel estimation over vintages
+def estimate_vintages(vintages,spec_file,data_dir,output_dir,prefix = "ResDFM_",sample_start = None,
+                      threshold = 1e-4,accel = None,n_workers = None,blas_threads = 1,warm_start = False,
+                      max_time = None,skip_done = False,max_iter = 5000):
+    # estimate_vintages    Estimates the DFM on several data vintages and
+    #                      stores one ResDFM pickle per vintage
+    #
+    #  Syntax:
+    #    report = estimate_vintages(vintages, spec_file, data_dir, output_dir, prefix,
+    #                               sample_start, threshold, accel, n_workers,
+    #                               blas_threads, warm_start, max_time, skip_done,
+    #                               max_iter)
+    #
+    #  Description:
+    #    Each vintage is estimated independently by estimate_vintage() in a
+    #    pool of n_workers processes. The workers are started with the
+    #    BLAS/OpenMP thread pools limited to blas_threads threads, so that
+    #    n_workers*blas_threads does not oversubscribe the cores. Each result
+    #    is written to output_dir/<prefix>YYYYMMDD.pickle as soon as it is
+    #    done, through a temporary file that is renamed into place: a stopped
+    #    or failed run never leaves a partial pickle behind.
+    #
+    #    With n_workers = 1 the vintages run in order in the current process,
+    #    with its thread settings. This is the only mode that supports
+    #    warm_start, since every vintage then starts from the estimates of
+    #    the previous one (see WarmStart in dfm.py). Only converged estimates
+    #    are passed on: after a vintage that did not converge, the next one
+    #    starts from the initial conditions. Warm starts save EM steps per
+    #    vintage, the pool saves wall time across vintages.
+    #
+    #    The workers are started with the "spawn" method, so scripts calling
+    #    estimate_vintages() with n_workers > 1 need an
+    #    if __name__ == "__main__": guard.
+    #
+    #    The EM loop of each vintage is checkpointed next to its result
+    #    (.<prefix>YYYYMMDD.ckpt, see dfm) and resumes from there when the
+    #    batch is run again, e.g. after the job was pre-empted or stopped on
+    #    max_time. A vintage whose EM loop stopped on max_time keeps its
+    #    checkpoint and gets no ResDFM pickle. A vintage that converged or
+    #    reached max_iter gets its pickle, and its checkpoint is removed.
+    #
+    #    An error in one vintage (e.g. a malformed data file) does not stop
+    #    the batch: the vintage gets a row with em_stop = "error" and the
+    #    error message, and the remaining vintages are estimated.
+    #
+    #  Input:
+    #    vintages:     List of vintages, "YYYY-MM-DD"
+    #    spec_file:    Model specification file
+    #    data_dir:     Folder with the data vintages YYYY-MM-DD.xlsx
+    #    output_dir:   Folder of the ResDFM pickles (created if needed)
+    #    prefix:       File name prefix of the pickles
+    #    sample_start: Start of the estimation sample (date number), or None
+    #    threshold:    Convergence threshold of the EM algorithm
+    #    accel:        EM acceleration (see dfm)
+    #    n_workers:    Number of worker processes (None: one per core)
+    #    blas_threads: BLAS threads per worker (None: leave unchanged)
+    #    warm_start:   True to chain the vintages (needs n_workers = 1)
+    #    max_time:     Wall-clock budget of the EM loop per vintage and run,
+    #                  in seconds, or None
+    #    skip_done:    True to skip vintages that already have a pickle
+    #    max_iter:     Maximum number of EM steps per vintage (see dfm)
+    #
+    #  Output:
+    #    report: DataFrame with one row per vintage, in the order of vintages
+    #      .file:      Path of the stored pickle (None if stopped on max_time
+    #                  or failed)
+    #      .converged: False if the EM loop stopped on max_time or max_iter
+    #      .em_stop:   Reason the EM loop stopped (see dfm), or "error"
+    #      .error:     Error message of a failed vintage (None otherwise)
+    #      .init:      Vintage whose estimates started the EM loop (None
+    #                  for the initial conditions of InitCond)
+    #      .load_time: Time to load and transform the data, in seconds
+    #      .em_time:   Time of the EM loop, in seconds
+    #      .em_iter:   Number of EM steps
+    #      .loglik:    Final log-likelihood
+    #      .time:      Total time of the vintage, in seconds
+
+    if warm_start and n_workers is not None and n_workers > 1:
+        raise ValueError("warm_start chains the vintages and needs n_workers = 1")
+
+    os.makedirs(output_dir,exist_ok = True)
+    args = (spec_file,data_dir,output_dir,prefix,sample_start,threshold,accel,max_time,max_iter)
+
+    if skip_done:
+        done     = [v for v in vintages if os.path.exists(result_path(output_dir,prefix,v))]
+        vintages = [v for v in vintages if v not in done]
+        if len(done) > 0:
+            print("Skipping {} vintages already estimated in {}".format(len(done),output_dir))
+        if len(vintages) == 0:
+            return pd.DataFrame(columns = ["vintage","file","converged","em_stop","error","load_time","em_time","em_iter","loglik",
+                                           "time","init"])
+
+    if warm_start:
+        n_workers = 1
+    elif n_workers is None:
+        n_workers = os.cpu_count()
+    n_workers = max(1,min(n_workers,len(vintages)))
+
+    rows = []
+    t0   = time.time()
+
+    if n_workers == 1:
+        Res_prev = None
+        v_prev   = None
+        for vintage in vintages:
+            try:
+                row,Res = estimate_vintage(vintage,*args,init = Res_prev,keep = warm_start)
+            except Exception as err:
+                row,Res = failed_row(vintage,err),None
+            row["init"] = v_prev
+            rows.append(row)
+            print_timing(row)
+
+            # Chain only converged estimates
+            if warm_start and row["converged"]:
+                Res_prev,v_prev = Res,vintage
+            else:
+                Res_prev,v_prev = None,None
+    else:
+        # Workers read the thread settings from the environment when they
+        # import numpy, so the variables are set only while the pool lives
+        env_prev = {v : os.environ.get(v) for v in BLAS_THREAD_VARS}
+        if blas_threads is not None:
+            os.environ.update({v : str(blas_threads) for v in BLAS_THREAD_VARS})
+        try:
+            with ProcessPoolExecutor(n_workers,mp_context = multiprocessing.get_context("spawn")) as pool:
+                jobs = {pool.submit(estimate_vintage,vintage,*args,keep = False) : vintage for vintage in vintages}
+                for job in as_completed(jobs):
+                    try:
+                        row,_ = job.result()
+                    except Exception as err:
+                        row = failed_row(jobs[job],err)
+                    row["init"] = None
+                    rows.append(row)
+                    print_timing(row)
+        finally:
+            for v,val in env_prev.items():
+                if val is None:
+                    os.environ.pop(v,None)
+                else:
+                    os.environ[v] = val
+
+    print("Estimated {} vintages in {:.1f}s ({} workers)".format(len(rows),time.time() - t0,n_workers))
+
+    return pd.DataFrame(rows).set_index("vintage").loc[vintages].reset_index()
+
+def estimate_vintage(vintage,spec_file,data_dir,output_dir,prefix,sample_start,threshold,accel,max_time = None,
+                     max_iter = 5000,init = None,keep = True):
+    # estimate_vintage    Loads one data vintage, runs dfm() and stores
+    # {"Res": Res, "Spec": Spec} atomically. Returns the timing row of
+    # estimate_vintages() and the stored dictionary (None if keep is False,
+    # to avoid sending it back from a worker)
+
+    t0 = time.time()
+
+    Spec     = load_spec(spec_file)
+    datafile = os.path.join(data_dir,vintage + ".xlsx")
+    X,Time,Z = load_data(datafile,Spec,sample_start)
+
+    if X.shape[1] != len(Spec.SeriesName):
+        raise ValueError("Data of vintage {} do not match the specification".format(vintage))
+
+    t_load = time.time() - t0
+
+    output_path = result_path(output_dir,prefix,vintage)
+    ckpt_path   = os.path.join(output_dir,"." + prefix + vintage.replace("-","") + ".ckpt")
+
+    Res = dfm(X,Spec,threshold,max_iter = max_iter,accel = accel,init = init,em_checkpoint = ckpt_path,
+              max_time = max_time)
+    Res = {"Res": Res,"Spec": Spec}
+
+    # Only a time-budget stop is resumed by the next run
+    if Res["Res"]["em_stop"] == "max_time":
+        output_path = None
+    else:
+        SaveAtomic(Res,output_path)
+        os.remove(ckpt_path)
+
+    row = {"vintage"   : vintage,
+           "file"      : output_path,
+           "converged" : Res["Res"]["converged"],
+           "em_stop"   : Res["Res"]["em_stop"],
+           "error"     : None,
+           "load_time" : t_load,
+           "em_time"   : Res["Res"]["em_time"],
+           "em_iter"   : Res["Res"]["em_iter"],
+           "loglik"    : Res["Res"]["loglik"][-1],
+           "time"      : time.time() - t0}
+
+    return row,(Res if keep else None)
+
+def failed_row(vintage,err):
+    # failed_row    Row of estimate_vintages() for a vintage whose estimation
+    # raised err
+
+    return {"vintage"   : vintage,
+            "file"      : None,
+            "converged" : False,
+            "em_stop"   : "error",
+            "error"     : "{}: {}".format(type(err).__name__,err),
+            "load_time" : np.nan,
+            "em_time"   : np.nan,
+            "em_iter"   : 0,
+            "loglik"    : np.nan,
+            "time"      : np.nan}
+
+def result_path(output_dir,prefix,vintage):
+    # result_path    Path of the ResDFM pickle of a vintage
+
+    return os.path.join(output_dir,prefix + vintage.replace("-","") + ".pickle")
+
+def print_timing(row):
+    # print_timing    One line of progress per estimated vintage
+
+    if row["em_stop"] == "error":
+        print("{}: failed, {}".format(row["vintage"],row["error"]))
+        return
+
+    print("{}: {} EM steps, loglik {:.3f}, {:.1f}s (data {:.1f}s, EM {:.1f}s) -> {}".format(
+          row["vintage"],row["em_iter"],row["loglik"],row["time"],row["load_time"],row["em_time"],
+          row["file"] if row["file"] is not None else "time budget ran out, checkpoint kept"))
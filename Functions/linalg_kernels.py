@@ -0,0 +1,149 @@
+#-------------------------------------------------Libraries
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve, lu_factor, lu_solve, LinAlgError
+
+
+#-------------------------------------------------Factorization-based linear algebra
+def factor(M,spd = True):
+    # factor    Factorizes a square matrix once so that it can be reused
+    #
+    #  Syntax:
+    #    F = factor(M, spd)
+    #
+    #  Description:
+    #    The Kalman filter, smoother and EM steps in dfm.py need solves with
+    #    and log-determinants of the same matrices (innovation covariances,
+    #    prior state covariances, EM normal equations). factor() computes a
+    #    single factorization that factor_solve(), factor_logdet() and
+    #    factor_inv() then share:
+    #      - spd = True:  Cholesky factorization. If M is not numerically
+    #                     positive definite, falls back to the pseudo-inverse
+    #                     (as np.linalg.pinv) instead of failing.
+    #      - spd = False: LU factorization with partial pivoting.
+    #
+    #  Input:
+    #    M:   n-by-n matrix
+    #    spd: True if M is symmetric positive definite
+    #
+    #  Output:
+    #    F: dictionary with the factorization
+    #      .kind: "chol", "lu" or "pinv"
+    #      .fac:  Factorization (pseudo-inverse for "pinv")
+    #      .M:    Input matrix (used for the log-determinant of "pinv")
+
+    if spd:
+        try:
+            return {"kind" : "chol", "fac" : cho_factor(M,lower = True,check_finite = False), "M" : M}
+        except LinAlgError:
+            return {"kind" : "pinv", "fac" : np.linalg.pinv(M), "M" : M}
+    else:
+        return {"kind" : "lu", "fac" : lu_factor(M,check_finite = False), "M" : M}
+
+def factor_solve(F,B):
+    # factor_solve    Solves M*X = B given F = factor(M)
+
+    if F["kind"] == "chol":
+        return cho_solve(F["fac"],B,check_finite = False)
+    elif F["kind"] == "lu":
+        return lu_solve(F["fac"],B,check_finite = False)
+    else:
+        return np.matmul(F["fac"],B)
+
+def factor_logdet(F):
+    # factor_logdet    log|M| given F = factor(M)
+
+    if F["kind"] == "chol":
+        return 2*np.sum(np.log(np.diag(F["fac"][0])))
+    elif F["kind"] == "lu":
+        return np.sum(np.log(np.abs(np.diag(F["fac"][0]))))
+    else:
+        return np.linalg.slogdet(F["M"])[1]
+
+def factor_inv(F):
+    # factor_inv    inv(M) given F = factor(M). Only use when the inverse
+    # itself is needed; factor_solve() is cheaper and more accurate.
+
+    if F["kind"] == "pinv":
+        return F["fac"].copy()
+
+    return factor_solve(F,np.eye(F["M"].shape[0]))
+
+def spd_solve(M,B):
+    # spd_solve    Solves M*X = B for a symmetric positive definite M
+
+    return factor_solve(factor(M),B)
+
+def ols(X,y):
+    # ols    OLS coefficients inv(X'*X)*X'*y through a Cholesky solve
+    #
+    #  Input:
+    #    X: T-by-k matrix of regressors
+    #    y: T-by-1 (or T-by-j) matrix of dependent variables
+    #
+    #  Output:
+    #    beta: k-by-1 (or k-by-j) matrix of coefficients
+
+    return spd_solve(np.matmul(X.T,X),np.matmul(X.T,y))
+
+def batch_solve(M,B,logdet = False):
+    # batch_solve    Solves M[i]*X[i] = B[i] for a stack of square matrices
+    #
+    #  Input:
+    #    M:      nb-by-n-by-n array
+    #    B:      nb-by-n-by-j array
+    #    logdet: If True, also returns log|M[i]|
+    #
+    #  Output:
+    #    X:  nb-by-n-by-j array. If any M[i] is singular, the pseudo-inverse
+    #        is used for the whole stack (as in factor())
+    #    ld: nb vector, log-determinants (only if logdet is True)
+
+    try:
+        X = np.linalg.solve(M,B)
+    except LinAlgError:
+        X = np.matmul(np.linalg.pinv(M),B)
+
+    if logdet:
+        return X,np.linalg.slogdet(M)[1]
+
+    return X
+
+def lyapunov(A,Q):
+    # lyapunov    Solves the discrete Lyapunov equation V = A*V*A' + Q
+    #
+    #  Description:
+    #    V is the unconditional covariance of the stationary VAR(1)
+    #    z_t = A*z_(t-1) + e_t with cov(e_t) = Q. The equation is solved as
+    #    the linear system (I - kron(A,A))*vec(V) = vec(Q), which has size
+    #    k^2 for k states. For a block diagonal A (and Q), pass the diagonal
+    #    blocks as a stack: each block is solved on its own, instead of one
+    #    system in the size of the whole matrix squared. Blocks with the
+    #    same A (e.g. the quarterly idiosyncratic blocks, which only differ
+    #    by Q) share one system: it is built and solved once, with their Qs
+    #    as right-hand sides.
+    #
+    #  Input:
+    #    A: k-by-k matrix, or nb-by-k-by-k stack of diagonal blocks
+    #    Q: Same shape as A
+    #
+    #  Output:
+    #    V: Same shape as A
+
+    A_stk = np.asarray(A).reshape((-1,) + np.shape(A)[-2:])
+    Q_stk = np.asarray(Q).reshape(A_stk.shape)
+    nb,k  = A_stk.shape[:2]
+
+    # Distinct blocks of A (first block of each group) and the group of each block
+    first = {}
+    grp   = np.array([first.setdefault(A_stk[b].tobytes(),len(first)) for b in range(nb)])
+    A_u   = A_stk[[grp.tolist().index(g) for g in range(len(first))]]
+
+    # kron(A_i,A_i) for every distinct block
+    AA = np.einsum("bij,bkl->bikjl",A_u,A_u).reshape((-1,k*k,k*k))
+
+    V = np.zeros((nb,k*k),dtype = np.result_type(A_stk,Q_stk))
+    for g in range(A_u.shape[0]):
+        ix    = grp == g
+        V[ix] = batch_solve(np.eye(k*k) - AA[g],Q_stk[ix].reshape((-1,k*k)).T).T
+
+    return V.reshape(np.shape(A))
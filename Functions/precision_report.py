@@ -0,0 +1,103 @@
+#-------------------------------------------------Libraries
+import os
+import re
+import time
+import pickle
+import numpy as np
+import pandas as pd
+from datetime import datetime as dt
+from dateutil.relativedelta import relativedelta
+from Functions.load_data import load_data
+from Functions.load_spec import load_spec
+from Functions.dfm import runKF
+
+
+#-------------------------------------------------Single vs double precision nowcasts
+def precision_report(param_dir = "DFM_quarter_param_fiscal",spec_file = "Spec_US_fiscal.xlsx",
+                     data_dir = os.path.join("data","US_fiscal"),series = "GDPC1",
+                     dtype = np.float32,A_blk = None):
+    # precision_report    Compares nowcasts computed in reduced precision with
+    #                     the float64 ones on the stored quarterly parameters
+    #
+    #  Syntax:
+    #    report = precision_report(param_dir, spec_file, data_dir, series, dtype, A_blk)
+    #
+    #  Description:
+    #    For every ResDFM_*_YYYYMMDD.pickle in param_dir, loads the data
+    #    vintage YYYY-MM-DD.xlsx from data_dir, extends it 12 months into the
+    #    future (as update_nowcast2) and runs the Kalman filter and smoother
+    #    with the stored parameters twice: in float64 and in dtype. The
+    #    common component X_sm = C*Z_t|T*Wx + Mx of both runs is compared,
+    #    together with the nowcast of series for the quarter of the vintage.
+    #
+    #  Input:
+    #    param_dir: Folder with the estimated parameters (output of dfm())
+    #    spec_file: Model specification file
+    #    data_dir:  Folder with the data vintages
+    #    series:    Series ID of the nowcast target
+    #    dtype:     Floating point type to validate against float64
+    #    A_blk:     Block sizes of A (see SKF), or None
+    #
+    #  Output:
+    #    report: DataFrame with one row per vintage
+    #      .nowcast_64, .nowcast_lo: Nowcast of series in each precision
+    #      .nowcast_diff:            Absolute difference of the nowcasts
+    #      .max_diff:                Max absolute difference of X_sm, all series
+    #      .max_diff_std:            Same, in units of the standardized data
+    #      .loglik_diff:             Absolute difference of the log-likelihoods
+    #      .time_64, .time_lo:       Run times in seconds
+
+    Spec = load_spec(spec_file)
+    i_series = np.where(series == Spec.SeriesID)[0][0]
+
+    files = sorted(f for f in os.listdir(param_dir) if re.match(r"ResDFM_.*_?\d{8}\.pickle$",f))
+    rows  = []
+
+    for f in files:
+        vintage  = re.search(r"(\d{8})\.pickle$",f).group(1)
+        vintage  = "{}-{}-{}".format(vintage[:4],vintage[4:6],vintage[6:])
+        datafile = os.path.join(data_dir,vintage + ".xlsx")
+        if not os.path.exists(datafile):
+            print("Skipping {}: no data vintage {}".format(f,datafile))
+            continue
+
+        with open(os.path.join(param_dir,f),"rb") as h:
+            Res = pickle.load(h)["Res"]
+
+        X,Time,_ = load_data(datafile,Spec)
+
+        # Extend the data 12 months into the future
+        X      = np.vstack([X,np.full((12,X.shape[1]),np.nan)])
+        future = [(dt.fromordinal(Time[-1] - 366) + relativedelta(months = +i)).toordinal() + 366 for i in range(1,13)]
+        Time   = np.hstack([Time,future])
+        y      = ((X - Res["Mx"])/Res["Wx"]).T
+
+        # Nowcast period: last month of the quarter of the vintage
+        v_dt      = dt.strptime(vintage,"%Y-%m-%d")
+        q_end     = dt(v_dt.year,3*((v_dt.month - 1)//3 + 1),1).toordinal() + 366
+        t_nowcast = np.where(Time == q_end)[0][0]
+
+        out = {}
+        for name,dt_run in [("64",np.float64),("lo",dtype)]:
+            t0 = time.time()
+            Zsmooth,_,_,loglik = runKF(y,Res["A"],Res["C"],Res["Q"],Res["R"],Res["Z_0"],Res["V_0"],
+                                       A_blk = A_blk,dtype = dt_run)
+            out["time_" + name] = time.time() - t0
+            out["x_sm_" + name] = np.matmul(Zsmooth[:,1:].T.astype(np.float64),Res["C"].T)
+            out["loglik_" + name] = float(loglik)
+
+        dX = np.abs(out["x_sm_64"] - out["x_sm_lo"])
+        nowcast_64 = out["x_sm_64"][t_nowcast,i_series]*Res["Wx"][i_series] + Res["Mx"][i_series]
+        nowcast_lo = out["x_sm_lo"][t_nowcast,i_series]*Res["Wx"][i_series] + Res["Mx"][i_series]
+
+        rows.append({"vintage"      : vintage,
+                     "nowcast_64"   : nowcast_64,
+                     "nowcast_lo"   : nowcast_lo,
+                     "nowcast_diff" : abs(nowcast_64 - nowcast_lo),
+                     "max_diff"     : np.max(dX*Res["Wx"]),
+                     "max_diff_std" : np.max(dX),
+                     "loglik_diff"  : abs(out["loglik_64"] - out["loglik_lo"]),
+                     "time_64"      : out["time_64"],
+                     "time_lo"      : out["time_lo"]})
+
+    return pd.DataFrame(rows)
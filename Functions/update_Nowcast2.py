@@ -3,13 +3,19 @@ from datetime import datetime as dt
 import pandas as pd
 import numpy as np
 from dateutil.relativedelta import relativedelta
-from Functions.update_Nowcast import News_DFM
 
-from Functions.dfm import SKF, FIS
+from Functions.dfm import FixedPoint
 
 
 # -------------------------------------------------update_nowcast2
-def update_nowcast2(X_old, X_new, Time, Spec, Res, series, period, vintage_old, vintage_new, display=True):
+def update_nowcast2(X_old, X_new, Time, Spec, Res, series, period, vintage_old, vintage_new, display=True,
+                    checkpoint=None, dtype=np.float64):
+    # checkpoint: Dictionary kept by the caller between calls (start with
+    # {}), or None. The smoother passes of News_DFM then restart from the
+    # first period whose data changed since the previous pass, e.g. across
+    # the vintages of a quarter nowcast with the same Res (see FixedPoint)
+    # dtype: Floating point type of the smoother passes (see SKF)
+
     # Convert vintage dates to ordinals
     if not isinstance(vintage_old, int):
         vintage_old = dt.strptime(vintage_old, '%Y-%m-%d').date().toordinal() + 366
@@ -60,8 +66,14 @@ def update_nowcast2(X_old, X_new, Time, Spec, Res, series, period, vintage_old,
     X_rev[np.isnan(X_old)] = np.nan
 
     # Compute news
-    y_old, _, _, _, _, _, _, _, _ = News_DFM(X_old, X_rev, Res, t_nowcast, i_series)
-    y_rev, y_new, _, actual, forecast, weight, _, _, _ = News_DFM(X_rev, X_new, Res, t_nowcast, i_series)
+    y_rev, y_new, _, actual, forecast, weight, _, _, _ = News_DFM(X_rev, X_new, Res, t_nowcast, i_series, checkpoint, dtype)
+
+    # Old nowcast: without data revisions X_rev is X_old, and y_old is y_rev
+    obs_old = ~np.isnan(X_old)
+    if np.array_equal(X_old[obs_old], X_rev[obs_old]):
+        y_old = y_rev
+    else:
+        y_old, _, _, _, _, _, _, _, _ = News_DFM(X_old, X_old, Res, t_nowcast, i_series, checkpoint, dtype)
 
     # Compute impacts
     impact_revisions = y_rev - y_old
@@ -109,3 +121,96 @@ def update_nowcast2(X_old, X_new, Time, Spec, Res, series, period, vintage_old,
         "vintage_old": vintage_old,
         "vintage_new": vintage_new
     }
+
+
+# -------------------------------------------------News_DFM
+def News_DFM(X_old, X_new, Res, t_fcst, v_news, checkpoint=None, dtype=np.float64):
+    # News_DFM    Nowcast of series v_news at period t_fcst with the old and
+    # the new data, and the contribution of each new release to its change
+    #
+    #  Syntax:
+    #    [y_old, y_new, singlenews, actual, forecast, weight, t_miss, v_miss, innov]
+    #    = News_DFM(X_old, X_new, Res, t_fcst, v_news, checkpoint, dtype)
+    #
+    #  Description:
+    #    The releases are the observations available in X_new but missing in
+    #    X_old. With x_r their standardized values, the nowcast changes by
+    #           gain*(x_r - E[x_r|X_old])
+    #           gain = Wx(v_news)*C(v_news,:)*Cov(Z_t_fcst, x_r|X_old)*inv(Var(x_r|X_old))
+    #    (Banbura & Modugno, 2014). E[x_r|X_old] and the covariances come from
+    #    one pass of the fixed-point smoother FixedPoint() on X_old, with the
+    #    target period and the release periods as fixed points, so that the
+    #    smoothed covariances of every period and their lags are not needed.
+    #
+    #    If X_new only adds releases to X_old, the decomposition is exact and
+    #    y_new = y_old + the sum of the impacts. With data revisions, y_new
+    #    comes from a second pass on X_new. If the target is observed in
+    #    X_new, y_new is that observation and there is no news.
+    #
+    #  Input:
+    #    X_old, X_new: T-by-N old and new data (same size, NaN if missing)
+    #    Res:          Estimation results of dfm()
+    #    t_fcst:       Target period (row of X, 1-vector)
+    #    v_news:       Target series (column of X, 1-vector)
+    #    checkpoint:   Filter checkpoint of FixedPoint(), or None
+    #    dtype:        Floating point type of FixedPoint()
+    #
+    #  Output:
+    #    y_old, y_new:   1-vectors, nowcasts with X_old and X_new
+    #    singlenews:     1-by-N, impact of the releases of each series
+    #    actual:         N-by-1, released value of each series (the last one
+    #                    if a series has several releases, NaN if none)
+    #    forecast:       N-by-1, expectation of that value given X_old
+    #    weight:         N-by-1, weight of the news of each series
+    #    t_miss, v_miss: Periods and series of the releases
+    #    innov:          Standardized news of the releases
+
+    Mx = Res["Mx"]
+    Wx = Res["Wx"]
+    C = Res["C"]
+    par = (Res["A"], C, Res["Q"], Res["R"], Res["Z_0"], Res["V_0"])
+
+    N = X_new.shape[1]
+    t_fcst = int(np.asarray(t_fcst).flatten()[0])
+    v_news = int(np.asarray(v_news).flatten()[0])
+
+    singlenews = np.zeros((1, N))
+    actual = np.full((N, 1), np.nan)
+    forecast = np.full((N, 1), np.nan)
+    weight = np.full((N, 1), np.nan)
+
+    # Releases: observations missing in X_old and available in X_new
+    t_miss, v_miss = np.where(np.isnan(X_old) & ~np.isnan(X_new))
+
+    # Old nowcast, forecasts of the releases and their covariances
+    S = FixedPoint(((X_old - Mx) / Wx).T, *par, t_fcst, t_miss, v_miss, Res.get("A_blk"), checkpoint, dtype)
+    y_old = Wx[v_news] * np.matmul(C[[v_news], :], S["Z_target"])[0] + Mx[v_news]
+
+    if not np.isnan(X_new[t_fcst, v_news]):
+        y_new = X_new[[t_fcst], v_news]
+        singlenews[0, v_news] = y_new[0] - y_old[0]
+        empty = np.zeros(0, dtype=np.int64)
+        return y_old, y_new, singlenews, actual, forecast, weight, empty, empty, np.zeros(0)
+
+    innov = np.zeros(0)
+    impact = np.zeros(0)
+    if t_miss.size > 0:
+        innov = (X_new[t_miss, v_miss] - Mx[v_miss]) / Wx[v_miss] - S["y_obs"]
+        gain = Wx[v_news] * np.linalg.solve(S["var_obs"], np.matmul(C[v_news, :], S["cov_obs"]))
+        impact = gain * innov
+
+        for i in range(t_miss.size):
+            actual[v_miss[i], 0] = X_new[t_miss[i], v_miss[i]]
+            forecast[v_miss[i], 0] = Wx[v_miss[i]] * S["y_obs"][i] + Mx[v_miss[i]]
+            weight[v_miss[i], 0] = gain[i] / Wx[v_miss[i]]
+            singlenews[0, v_miss[i]] += impact[i]
+
+    # New nowcast: exact decomposition unless X_new revises X_old
+    obs_old = ~np.isnan(X_old)
+    if np.array_equal(X_old[obs_old], X_new[obs_old]):
+        y_new = y_old + np.sum(impact)
+    else:
+        S_new = FixedPoint(((X_new - Mx) / Wx).T, *par, t_fcst, A_blk=Res.get("A_blk"), checkpoint=checkpoint, dtype=dtype)
+        y_new = Wx[v_news] * np.matmul(C[[v_news], :], S_new["Z_target"])[0] + Mx[v_news]
+
+    return y_old, y_new, singlenews, actual, forecast, weight, t_miss, v_miss, innov
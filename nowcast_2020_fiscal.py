@@ -107,6 +107,7 @@ for period, vintages in vintages_dict_2020.items():
 
     results_list = []
     news_tables_dict = {}
+    checkpoint = {}  # restarts the smoother passes across the vintages
 
     for i in range(1, len(vintages)):
         vintage_old = vintages[i-1]
@@ -124,7 +125,7 @@ for period, vintages in vintages_dict_2020.items():
             results = update_nowcast2(
                 X_old, X_new, Time, Spec, Res,
                 series, period, vintage_old, vintage_new,
-                display=False
+                display=False, checkpoint=checkpoint
             )
 
             y_old = results["y_old"][0]
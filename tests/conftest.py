@@ -0,0 +1,6 @@
+#-------------------------------------------------Import path
+# The tests import the Functions package from the repository root
+import os
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
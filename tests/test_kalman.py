@@ -0,0 +1,145 @@
+#-------------------------------------------------Libraries
+import os
+import pickle
+import numpy as np
+import pytest
+from Functions.load_spec import load_spec
+from Functions.load_data import load_data
+from Functions.dfm import SKF, FIS, runKF, runKF_batch, FixedPoint
+from Functions.update_Nowcast2 import News_DFM
+
+
+#-------------------------------------------------Stored vintage
+# Equivalence checks of the filter modes and engines of dfm.py against the
+# standard SKF/FIS pass, on the 2025-04-01 vintage of the fiscal panel and
+# the parameters estimated on it
+ROOT     = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARAM    = os.path.join(ROOT,"DFM_quarter_param_fiscal","ResDFM_fiscal_20250401.pickle")
+DATAFILE = os.path.join(ROOT,"data","US_fiscal","2025-04-01.xlsx")
+SPECFILE = os.path.join(ROOT,"Spec_US_fiscal.xlsx")
+
+
+@pytest.fixture(scope = "module")
+def vintage():
+    Spec     = load_spec(SPECFILE)
+    X,Time,_ = load_data(DATAFILE,Spec)
+    with open(PARAM,"rb") as h:
+        Res = pickle.load(h)["Res"]
+
+    # 6 months of forecast horizon, as the nowcasts
+    X   = np.vstack([X,np.full((6,X.shape[1]),np.nan)])
+    y   = ((X - Res["Mx"])/Res["Wx"]).T
+    par = (Res["A"],Res["C"],Res["Q"],Res["R"],Res["Z_0"],Res["V_0"])
+
+    return {"X" : X,"y" : y,"par" : par,"Res" : Res}
+
+@pytest.fixture(scope = "module")
+def reference(vintage):
+    # Standard filter and smoother
+    S = SKF(vintage["y"],*vintage["par"])
+    S = FIS(vintage["par"][0],S)
+    return S
+
+def check_smoothed(zsmooth,Vsmooth,loglik,S,tol = 1e-8):
+    assert np.max(np.abs(zsmooth - S["ZmT"])) < tol
+    if Vsmooth is not None:
+        assert np.max(np.abs(Vsmooth - S["VmT"])) < tol
+    assert abs(loglik - S["loglik"]) < tol*abs(S["loglik"])
+
+
+#-------------------------------------------------Filter modes
+@pytest.mark.parametrize("mode",["standard","univariate","information","collapsed"])
+def test_mode(vintage,reference,mode):
+    zsmooth,Vsmooth,VVsmooth,loglik = runKF(vintage["y"],*vintage["par"],mode = mode)
+    check_smoothed(zsmooth,Vsmooth,loglik,reference)
+    assert np.max(np.abs(VVsmooth - reference["VmT_1"])) < 1e-8
+
+def test_steady_state(vintage,reference):
+    # The cached covariances differ from the full recursion by about ss_tol
+    zsmooth,Vsmooth,_,loglik = runKF(vintage["y"],*vintage["par"],ss_tol = 1e-12)
+    check_smoothed(zsmooth,Vsmooth,loglik,reference,tol = 1e-6)
+
+def test_compact(vintage):
+    # Compact storage only drops copies of the steady-state covariances
+    A = vintage["par"][0]
+    S = FIS(A,SKF(vintage["y"],*vintage["par"],ss_tol = 1e-9))
+    S_c = SKF(vintage["y"],*vintage["par"],ss_tol = 1e-9,compact = True)
+    assert S_c["Vm"].shape[0] < S["Vm"].shape[0]
+    S_c = FIS(A,S_c)
+    check_smoothed(S_c["ZmT"],S_c["VmT"],S_c["loglik"],S,tol = 1e-12)
+
+def test_stats(vintage,reference):
+    # Sums of the smoothed covariances accumulated for the fused E-step
+    S = FIS(vintage["par"][0],SKF(vintage["y"],*vintage["par"]),stats = True)
+    assert np.max(np.abs(S["ZmT"] - reference["ZmT"])) < 1e-12
+    assert np.max(np.abs(S["stats"]["V_pat"].sum(axis = 0) - reference["VmT"][1:].sum(axis = 0))) < 1e-8
+    assert np.max(np.abs(S["stats"]["VV"] - reference["VmT_1"].sum(axis = 0))) < 1e-8
+
+def test_checkpoint(vintage,reference):
+    # Restart after a change in the last periods of the data
+    y          = vintage["y"].copy()
+    y[:,-8]    = np.nan
+    checkpoint = {}
+    runKF(y,*vintage["par"],checkpoint = checkpoint)
+    zsmooth,Vsmooth,_,loglik = runKF(vintage["y"],*vintage["par"],checkpoint = checkpoint)
+    check_smoothed(zsmooth,Vsmooth,loglik,reference,tol = 1e-12)
+
+
+#-------------------------------------------------Engines
+@pytest.mark.parametrize("engine",["chandrasekhar","scan"])
+def test_engine(vintage,reference,engine):
+    zsmooth,Vsmooth,_,loglik = runKF(vintage["y"],*vintage["par"],engine = engine)
+    check_smoothed(zsmooth,Vsmooth,loglik,reference,tol = 1e-6)
+
+def test_float32(vintage,reference):
+    zsmooth,_,_,loglik = runKF(vintage["y"],*vintage["par"],dtype = np.float32)
+    assert zsmooth.dtype == np.float32
+    check_smoothed(zsmooth,None,loglik,reference,tol = 1e-3)
+
+def test_batch(vintage,reference):
+    # Two data sets with different missing values and lengths
+    y_2 = vintage["y"][:,:-10].copy()
+    y_2[:,-3:] = np.nan
+    zsmooth,Vsmooth,_,loglik = runKF_batch([vintage["y"],y_2],*vintage["par"])
+    check_smoothed(zsmooth[0],Vsmooth[0],loglik[0],reference)
+
+    z_2,_,_,ll_2 = runKF(y_2,*vintage["par"])
+    assert np.max(np.abs(zsmooth[1][:,:z_2.shape[1]] - z_2)) < 1e-8
+    assert abs(loglik[1] - ll_2) < 1e-8*abs(ll_2)
+
+
+#-------------------------------------------------Fixed-point smoother and news
+def test_fixed_point(vintage,reference):
+    y      = vintage["y"]
+    t      = y.shape[1] - 4
+    t_obs  = np.array([t - 6,t - 5,t - 5])
+    i_obs  = np.array([0,1,2])
+    S      = FixedPoint(y,*vintage["par"],t,t_obs,i_obs)
+    C      = vintage["par"][1]
+
+    assert np.max(np.abs(S["Z_target"][:,0] - reference["ZmT"][:,t+1])) < 1e-8
+    assert np.max(np.abs(S["V_target"] - reference["VmT"][t+1])) < 1e-8
+    assert abs(S["loglik"] - reference["loglik"]) < 1e-8*abs(reference["loglik"])
+    assert np.max(np.abs(S["y_obs"] - np.sum(C[i_obs,:]*reference["ZmT"][:,t_obs+1].T,axis = 1))) < 1e-8
+
+    # Restart from a checkpoint
+    checkpoint = {}
+    FixedPoint(y,*vintage["par"],t,checkpoint = checkpoint)
+    S_c = FixedPoint(y,*vintage["par"],t,t_obs,i_obs,checkpoint = checkpoint)
+    assert np.array_equal(S_c["Z"],S["Z"]) and np.array_equal(S_c["V"],S["V"])
+
+def test_news(vintage):
+    # The releases of the last 3 months move the nowcast to the one of the
+    # full data
+    X, Res = vintage["X"], vintage["Res"]
+    X_old  = X.copy()
+    X_old[-9:,:] = np.nan
+    t      = X.shape[0] - 4
+    i      = X.shape[1] - 3
+
+    y_old,y_new,singlenews,_,_,_,t_miss,_,_ = News_DFM(X_old,X,Res,[t],[i])
+    zsmooth,_,_,_ = runKF(vintage["y"],*vintage["par"])
+
+    assert t_miss.size > 0
+    assert abs(y_new[0] - (Res["Wx"][i]*np.matmul(Res["C"][i,:],zsmooth[:,t+1]) + Res["Mx"][i])) < 1e-8
+    assert abs(y_new[0] - y_old[0] - np.sum(singlenews)) < 1e-10